@@ -1,20 +1,38 @@
 import os
 import re
 import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from sys import intern
 from urllib.parse import urlsplit, urlunsplit
 
 import httpx
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+import plotly.io as pio
 import streamlit as st
 from dotenv import load_dotenv
 from collections import Counter
 
+# Serialize figures with orjson so large trace arrays hit the C fast path
+pio.json.config.default_engine = "orjson"
+
 # Load env
 load_dotenv()
 API_KEY = os.getenv("FIRECRAWL_API_KEY", "").strip()
 BASE_URL = os.getenv("FIRECRAWL_BASE_URL", "https://api.firecrawl.dev").rstrip("/")
 
+# Single split of scheme/host/path/query/fragment used by the vectorized normalizer
+_URL_RE = re.compile(r"^(https?)://([^/?#]+)([^?#]*)(?:\?([^#]*))?(?:#(.*))?$")
+_SLASH_RE = re.compile(r"/+")
+_LOGIN_TOKENS = (
+    "login", "sign-in", "signin", "wp-login", "user/login", "users/login",
+    "account/login", "my-account", "auth", "session/new", "wp-admin", "/admin/login",
+)
+_LOGIN_RE = re.compile("|".join(map(re.escape, _LOGIN_TOKENS)))
+
 ASSET_EXTS = (
     ".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif", ".svg", ".ico",
     ".css", ".js", ".map",
@@ -26,6 +44,11 @@ ASSET_EXTS = (
     ".dmg", ".exe", ".bin", ".apk",
 )
 
+# One anchored, case-insensitive scan instead of ~50 suffix compares per path;
+# matching re.I also drops the per-path lower() pass
+_ASSET_RE = re.compile(r"\.(?:" + "|".join(re.escape(e[1:]) for e in ASSET_EXTS) + r")\Z", re.IGNORECASE)
+_PAGE_EXT_RE = re.compile(r"\.(?:html?|php)\Z", re.IGNORECASE)
+
 # App chrome
 st.set_page_config(page_title="Site Mapper", layout="wide")
 st.title("Site Mapper")
@@ -34,9 +57,26 @@ st.caption("Map a site, optionally filter to pages-only, view dashboard stats, a
 if not API_KEY:
     st.error("API key is missing in .env (FIRECRAWL_API_KEY)")
 
+@st.cache_resource(show_spinner=False)
+def _http_client() -> httpx.Client:
+    # One client per session: reuses the TLS connection across clicks and
+    # negotiates HTTP/2 when the server supports it
+    return httpx.Client(http2=True, timeout=120.0, headers={"Authorization": f"Bearer {API_KEY}"})
+
+
+@st.cache_resource(show_spinner=False)
+def _fetch_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=1)
+
+
+def _post_map(payload: dict) -> dict:
+    resp = _http_client().post(f"{BASE_URL}/v1/map", json=payload)
+    resp.raise_for_status()
+    return resp.json()
+
+
 @st.cache_data(show_spinner=False)
 def call_firecrawl_map(url: str, include_subdomains: bool, limit: int, use_sitemap: bool, sitemap_only: bool) -> dict:
-    headers = {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"}
     payload = {
         "url": url,
         "includeSubdomains": include_subdomains,
@@ -45,17 +85,14 @@ def call_firecrawl_map(url: str, include_subdomains: bool, limit: int, use_sitem
         "sitemapOnly": bool(use_sitemap and sitemap_only),
         "limit": limit,
     }
-    with httpx.Client(timeout=120.0) as client:
-        resp = client.post(f"{BASE_URL}/v1/map", headers=headers, json=payload)
-        resp.raise_for_status()
-        return resp.json()
+    # Run the POST on a worker thread so the script thread is free while
+    # the (up to 120 s) request is in flight
+    return _fetch_pool().submit(_post_map, payload).result(timeout=130.0)
 
 
 def _normalize_path(path: str) -> str:
-    path = re.sub(r"/+", "/", path or "/")
-    if path != "/" and path.endswith("/"):
-        path = path[:-1]
-    return path
+    path = _SLASH_RE.sub("/", path or "/")
+    return path if path == "/" else path.removesuffix("/")
 
 
 def normalize_input_url(raw: str) -> str:
@@ -76,132 +113,182 @@ def normalize_input_url(raw: str) -> str:
     return urlunsplit((pu.scheme.lower(), pu.netloc.lower(), path, "", ""))
 
 
-# Updated: removed section filters parameter
+# Updated: removed section filters; normalization runs as one vectorized pandas
+# pipeline instead of a Python-level loop per URL.
 
-def normalize_pages_only(urls: list[str], base_host: str, include_subdomains: bool, preserve_qf: bool) -> list[str]:
-    out = []
-    for u in urls:
-        u = (u or "").strip()
-        if not u:
-            continue
-        pu = urlsplit(u)
-        if pu.scheme not in ("http", "https"):
-            continue
-        host = pu.netloc.lower()
-        # host filter
-        if not (host == base_host or (include_subdomains and host.endswith("." + base_host))):
-            continue
-        path = _normalize_path(pu.path)
-        lower = path.lower()
+def _normalize_common(urls: tuple[str, ...], base_host: str, include_subdomains: bool, preserve_qf: bool, pages_only: bool) -> tuple[list[str], bool]:
+    if not urls:
+        return [], False
+    s = pd.Series(urls, dtype="string").str.strip()
+    parts = s.str.extract(_URL_RE, expand=True)
+    parts.columns = ["scheme", "host", "path", "query", "frag"]
+    host = parts["host"].str.lower()
+    # host filter (non-http(s) / unparseable rows are NA and drop out here)
+    mask = host.eq(base_host)
+    if include_subdomains:
+        mask |= host.str.endswith("." + base_host)
+    # path normalization: collapse duplicate slashes, strip trailing slash except root
+    path = parts["path"].fillna("").replace("", "/").str.replace(_SLASH_RE, "/", regex=True)
+    path = path.mask(path.str.endswith("/") & path.ne("/"), path.str[:-1])
+    if pages_only:
         # assets/pages-only rule
-        if any(lower.endswith(ext) for ext in ASSET_EXTS):
-            continue
-        if "." in lower and not lower.endswith((".html", ".htm", ".php")):
-            continue
-        query = pu.query if preserve_qf else ""
-        frag = pu.fragment if preserve_qf else ""
-        out.append(urlunsplit((pu.scheme, host, path, query, frag)))
-    return sorted(set(out))
-
-
-# Updated: removed `filters` param and section filtering
-
-def normalize_internal_all(urls: list[str], base_host: str, include_subdomains: bool, preserve_qf: bool) -> list[str]:
-    out = []
-    for u in urls:
-        u = (u or "").strip()
-        if not u:
-            continue
-        pu = urlsplit(u)
-        if pu.scheme not in ("http", "https"):
-            continue
-        host = pu.netloc.lower()
-        # host filter
-        if not (host == base_host or (include_subdomains and host.endswith("." + base_host))):
-            continue
-        path = _normalize_path(pu.path)
-        query = pu.query if preserve_qf else ""
-        frag = pu.fragment if preserve_qf else ""
-        out.append(urlunsplit((pu.scheme, host, path, query, frag)))
-    return sorted(set(out))
-
-
-def compute_depth(url: str) -> int:
-    path = urlsplit(url).path or "/"
-    segs = [s for s in path.split("/") if s]
-    return len(segs)
-
-
-def looks_like_login(url: str) -> bool:
-    p = urlsplit(url)
-    s = (p.path + "?" + (p.query or "")).lower()
-    tokens = [
-        "login", "sign-in", "signin", "wp-login", "user/login", "users/login",
-        "account/login", "my-account", "auth", "session/new", "wp-admin", "/admin/login",
-    ]
-    return any(t in s for t in tokens)
-
-
-def render_treemap_go_from_urls(urls: list[str], levels: int):
-    # Build unique node ids with aggregated counts so parent == sum(children)
-    levels = max(2, int(levels))
-    counts: Counter[tuple[str, ...]] = Counter()
-
-    # Track a representative URL for each node, and detect whether a leaf maps to exactly one URL
-    example_url: dict[tuple[str, ...], str] = {}
-    leaf_first_url: dict[tuple[str, ...], str] = {}
-    leaf_multi: set[tuple[str, ...]] = set()
-
-    for u in urls:
+        mask &= ~path.str.contains(_ASSET_RE)
+        mask &= ~(path.str.contains(".", regex=False) & ~path.str.contains(_PAGE_EXT_RE))
+    out = parts["scheme"] + "://" + host + path
+    query = parts["query"].fillna("") if preserve_qf else ""
+    if preserve_qf:
+        frag = parts["frag"].fillna("")
+        out = out.where(query.eq(""), out + "?" + query)
+        out = out.where(frag.eq(""), out + "#" + frag)
+    # Rows failing the URL regex have NA hosts and are already masked out,
+    # so the kept rows need no NA scan. unique() dedups in O(N) while
+    # keeping the crawl order the API returned — no O(N log N) sort
+    kept = mask.fillna(False)
+    out = out[kept]
+    # Login detection piggybacks on this pass instead of re-parsing every URL
+    path_query = (path + "?" + query)[kept].str.lower()
+    login_found = bool(path_query.str.contains(_LOGIN_RE).any())
+    return out.unique().tolist(), login_found
+
+
+@st.cache_data(show_spinner=False)
+def normalize_pages_only(urls: tuple[str, ...], base_host: str, include_subdomains: bool, preserve_qf: bool) -> tuple[list[str], bool]:
+    return _normalize_common(urls, base_host, include_subdomains, preserve_qf, pages_only=True)
+
+
+@st.cache_data(show_spinner=False)
+def normalize_internal_all(urls: tuple[str, ...], base_host: str, include_subdomains: bool, preserve_qf: bool) -> tuple[list[str], bool]:
+    return _normalize_common(urls, base_host, include_subdomains, preserve_qf, pages_only=False)
+
+
+class _TrieNode:
+    """One treemap node; per-node data lives in parallel arrays keyed by idx."""
+    __slots__ = ("idx", "children")
+
+    def __init__(self, idx: int):
+        self.idx = idx
+        self.children = {}
+
+
+@dataclass
+class SiteAnalysis:
+    """Everything derived from the normalized URL list in one fused pass."""
+    hosts: list[str]
+    segs_list: list[list[str]]
+    depths: np.ndarray
+    sections: Counter
+    scheme: str
+    root: _TrieNode
+    counts: array
+    leaf_urls: list
+    leaf_multi: bytearray
+
+
+@st.cache_data(show_spinner=False)
+def analyze(urls: list[str]) -> SiteAnalysis:
+    """Single pass over the normalized URLs: one urlsplit per URL feeds the
+    depth array, the TOC section counts, and the treemap trie together, so
+    the URL strings are hot exactly once.
+
+    Hosts and segments are interned: a 10k-URL map repeats a handful of
+    unique strings, and interning makes the trie/Counter dict probes
+    pointer compares."""
+    n = len(urls)
+    hosts: list[str] = []
+    segs_list: list[list[str]] = []
+    depths = np.empty(n, dtype=np.int32)
+    sections: Counter = Counter()
+    # One sitemap shares one scheme in practice; parse it once for all hovers
+    scheme = urlsplit(urls[0]).scheme if urls else "https"
+    root = _TrieNode(-1)
+    counts = array("i")
+    leaf_urls: list[str | None] = []
+    leaf_multi = bytearray()
+
+    for i, u in enumerate(urls):
         pu = urlsplit(u)
-        host = pu.netloc or "/"
-        parts = [s for s in (pu.path or "/").split("/") if s]
-        chain = [host] + parts
-        k = min(levels, len(chain))
-        for i in range(k):
-            node = tuple(chain[: i + 1])
-            counts[node] += 1
-            # store a representative URL for this node
-            if node not in example_url:
-                example_url[node] = u
-        # leaf node at current level depth
-        leaf_node = tuple(chain[:k])
-        if leaf_node in leaf_first_url:
-            leaf_multi.add(leaf_node)
+        host = intern(pu.netloc or "/")
+        segs = [intern(s) for s in (pu.path or "/").split("/") if s]
+        hosts.append(host)
+        segs_list.append(segs)
+        depths[i] = len(segs)
+        sections[first_section(segs)] += 1
+        node = root
+        for seg in [host] + segs:
+            child = node.children.get(seg)
+            if child is None:
+                child = _TrieNode(len(counts))
+                node.children[seg] = child
+                counts.append(0)
+                leaf_urls.append(None)
+                leaf_multi.append(0)
+            node = child
+            counts[node.idx] += 1
+        # leaf node for the full chain
+        if leaf_urls[node.idx] is None:
+            leaf_urls[node.idx] = u
         else:
-            leaf_first_url[leaf_node] = u
+            leaf_multi[node.idx] = 1
+
+    return SiteAnalysis(hosts, segs_list, depths, sections, scheme, root, counts, leaf_urls, leaf_multi)
+
+
+@st.cache_data(show_spinner=False)
+def _treemap_arrays(urls: list[str]):
+    # Emit Plotly arrays from the trie built by analyze(); nodes carry only a
+    # dense integer id, counts/leaf state live in flat arrays indexed by it
+    an = analyze(urls)
+    root, counts, leaf_urls, leaf_multi = an.root, an.counts, an.leaf_urls, an.leaf_multi
+    default_scheme = an.scheme
 
     ids: list[str] = []
     labels: list[str] = []
     parents: list[str] = []
-    values: list[int] = []
+    # The DFS visits every trie node exactly once, so the values buffer can
+    # be preallocated at its final size and filled in place
+    values = np.empty(len(counts), dtype=np.int32)
     customdata: list[str] = []
 
-    nodes_sorted = sorted(counts.keys(), key=lambda t: (len(t), t))
-    id_map: dict[tuple[str, ...], str] = {node: "|" + "|".join(node) for node in nodes_sorted}
-
-    def node_prefix_url(node: tuple[str, ...]) -> str:
-        ex = example_url.get(node)
-        scheme = urlsplit(ex).scheme if ex else "https"
-        host = node[0] if node else ""
-        path = "/" + "/".join(node[1:]) if len(node) > 1 else "/"
-        return f"{scheme}://{host}{path}"
-
-    for node in nodes_sorted:
-        nid = id_map[node]
-        parent = "" if len(node) == 1 else id_map[node[:-1]]
-        label = node[-1] if node[-1] else "/"
+    # DFS emit; ids grow incrementally from the parent id, no tuple joins
+    out_pos = 0
+    stack = [(seg, root.children[seg], "", seg, "") for seg in sorted(root.children, reverse=True)]
+    while stack:
+        seg, node, parent_id, host, path = stack.pop()
+        i = node.idx
+        nid = parent_id + "|" + seg
         ids.append(nid)
-        labels.append(label)
-        parents.append(parent)
-        values.append(int(counts[node]))
+        labels.append(seg if seg else "/")
+        parents.append(parent_id)
+        values[out_pos] = counts[i]
+        out_pos += 1
         # Build hover text
-        if node in leaf_first_url and node not in leaf_multi:
-            hover = leaf_first_url[node]
+        if leaf_urls[i] is not None and not leaf_multi[i]:
+            hover = leaf_urls[i]
         else:
-            hover = f"{counts[node]} URLs under {node_prefix_url(node)}"
+            hover = f"{counts[i]} URLs under {default_scheme}://{host}{path if path else '/'}"
         customdata.append(hover)
+        for child_seg in sorted(node.children, reverse=True):
+            stack.append((child_seg, node.children[child_seg], nid, host, path + "/" + child_seg))
+
+    # NumPy-backed arrays serialize without per-element Python dispatch
+    return (
+        np.asarray(ids, dtype=object),
+        np.asarray(labels, dtype=object),
+        np.asarray(parents, dtype=object),
+        values,
+        np.asarray(customdata, dtype=object),
+    )
 
+
+def render_treemap_go_from_urls(urls: list[str]):
+    # Data prep is cached; only the (cheap) figure construction reruns
+    ids, labels, parents, values, customdata = _treemap_arrays(urls)
+
+    # Keep large maps browser-friendly: cap drill-down depth, and for big
+    # traces drop everything but labels to cut DOM churn
+    trace_kwargs = {}
+    if len(ids) > 5000:
+        trace_kwargs = dict(textinfo="label", tiling=dict(packing="squarify", squarifyratio=1))
     fig = go.Figure(
         go.Treemap(
             ids=ids,
@@ -209,12 +296,15 @@ def render_treemap_go_from_urls(urls: list[str], levels: int):
             parents=parents,
             values=values,
             branchvalues="total",
+            maxdepth=4,
             customdata=customdata,
             hovertemplate="%{customdata}<extra></extra>",
+            **trace_kwargs,
         )
     )
-    fig.update_layout(margin=dict(l=10, r=10, t=10, b=10), height=700)
-    st.plotly_chart(fig, use_container_width=True)
+    # uirevision keeps zoom/drill state across Streamlit reruns
+    fig.update_layout(margin=dict(l=10, r=10, t=10, b=10), height=700, uirevision="sitemap")
+    st.plotly_chart(fig, use_container_width=True, config={"staticPlot": False, "responsive": True})
 
 
 # Sidebar (minimal controls)
@@ -238,19 +328,15 @@ with st.sidebar:
 
 # Helper: top-level section for TOC
 
-def first_section(url: str) -> str:
-    path = urlsplit(url).path or "/"
-    segs = [s for s in path.split("/") if s]
+def first_section(segs: list[str]) -> str:
     return segs[0] if segs else "/"
 
 
-def build_toc_df(urls: list[str]) -> pd.DataFrame:
-    if not urls:
+@st.cache_data(show_spinner=False)
+def build_toc_df(sections: Counter) -> pd.DataFrame:
+    if not sections:
         return pd.DataFrame(columns=["section", "count"])
-    sections = [first_section(u) for u in urls]
-    s = pd.Series(sections).value_counts().reset_index()
-    s.columns = ["section", "count"]
-    return s
+    return pd.DataFrame(sections.most_common(), columns=["section", "count"])
 
 col1, _ = st.columns([1, 3])
 with col1:
@@ -259,6 +345,8 @@ with col1:
 state = st.session_state
 if "urls" not in state:
     state.urls = []
+    state.hosts = []
+    state.segs_list = []
     state.host = ""
     state.stats = {}
 
@@ -272,23 +360,28 @@ if run:
             normalized_url = normalize_input_url(base_url)
             host = urlsplit(normalized_url).netloc.lower()
             t0 = time.time()
-            data = call_firecrawl_map(normalized_url, include_subdomains, int(limit), use_sitemap, sitemap_only)
+            with st.spinner("Mapping site..."):
+                data = call_firecrawl_map(normalized_url, include_subdomains, int(limit), use_sitemap, sitemap_only)
             elapsed = time.time() - t0
-            links = data.get("links") or data.get("data") or []
+            # Tuple so the cached normalizers get a hashable argument
+            links = tuple(data.get("links") or data.get("data") or [])
 
-            # Updated: no section filters
+            # Updated: no section filters; login detection rides along with normalization
             if pages_only:
-                urls = normalize_pages_only(links, host, include_subdomains, preserve_qf)
+                urls, login_found = normalize_pages_only(links, host, include_subdomains, preserve_qf)
             else:
-                urls = normalize_internal_all(links, host, include_subdomains, preserve_qf)
+                urls, login_found = normalize_internal_all(links, host, include_subdomains, preserve_qf)
 
-            depths = [compute_depth(u) for u in urls]
+            # One fused pass; every downstream consumer reads from its arrays
+            an = analyze(urls)
+            depths = an.depths
             n_pages = len(urls)
-            avg_depth = float(pd.Series(depths).mean()) if n_pages else 0.0
-            max_depth = int(pd.Series(depths).max()) if n_pages else 0
-            login_found = any(looks_like_login(u) for u in urls)
+            avg_depth = float(depths.mean()) if depths.size else 0.0
+            max_depth = int(depths.max()) if depths.size else 0
 
             state.urls = urls
+            state.hosts = an.hosts
+            state.segs_list = an.segs_list
             state.host = host
             state.stats = {
                 "count": n_pages,
@@ -310,20 +403,21 @@ if run:
 
             # Table of contents (top-level sections)
             st.subheader("Table of contents")
-            toc_df = build_toc_df(urls)
+            toc_df = build_toc_df(an.sections)
             st.dataframe(toc_df, use_container_width=True, height=260)
 
             # URL table
             st.subheader("URLs")
             st.dataframe(pd.DataFrame({"url": urls, "depth": depths}), use_container_width=True, height=420)
-            st.download_button("Download CSV", pd.DataFrame({"url": urls}).to_csv(index=False), file_name="siteurls.csv", mime="text/csv")
+            # Single-column CSV built by string join; no DataFrame round-trip
+            csv_text = "url\n" + "\n".join(
+                ('"' + u.replace('"', '""') + '"') if ("," in u or '"' in u) else u for u in urls
+            ) + "\n"
+            st.download_button("Download CSV", csv_text, file_name="siteurls.csv", mime="text/csv")
 
             # Treemap (deepest possible)
-            max_segments = 1
-            for u in urls:
-                max_segments = max(max_segments, 1 + compute_depth(u))
             st.subheader("Treemap")
-            render_treemap_go_from_urls(urls, max_segments)
+            render_treemap_go_from_urls(urls)
         except ValueError as ve:
             st.error(str(ve))
         except Exception as e: